@@ -5,22 +5,96 @@ Procesa todas las imágenes en la carpeta photos/training y guarda los embedding
 """
 
 import os
-import pickle
+import json
 from pathlib import Path
+import cv2
 from deepface import DeepFace
 import numpy as np
 
 # Configuración
 PHOTOS_DIR = "photos/training"
-EMBEDDINGS_DIR = "embeddings"
-EMBEDDINGS_FILE = os.path.join(EMBEDDINGS_DIR, "face_embeddings.pkl")
+# Base de datos: un .npy por persona (en su propia carpeta, para que ningún ID
+# choque con los archivos de la base) más un manifest.json con los metadatos;
+# registrar a una persona nueva solo escribe su archivo
+EMBEDDINGS_DIR = "embeddings/db"
+FACES_DIR = os.path.join(EMBEDDINGS_DIR, "faces")
+MANIFEST_FILE = os.path.join(EMBEDDINGS_DIR, "manifest.json")
+PROJECTION_FILE = os.path.join(EMBEDDINGS_DIR, "projection.npy")
 
 # Modelo a usar (opciones: VGG-Face, Facenet, Facenet512, OpenFace, DeepFace, DeepID, ArcFace, Dlib, SFace)
 MODEL_NAME = "Facenet512"  # Facenet512 es muy preciso y rápido
 
+# Versión del formato de la base de embeddings
+# v2: embeddings float32 normalizados (norma L2 = 1)
+# v3: embeddings normalizados y cuantizados a int8 con una escala por persona
+# v4: la matriz de embeddings (N, D) int8 se guarda aparte en un .npy (cargable
+#     con mmap); el .pkl solo contiene los metadatos, en el mismo orden de filas,
+#     y opcionalmente "projection": base PCA (k, D) float32
+# v5: directorio con un faces/{person_id}.npy int8 por persona, manifest.json
+#     con los metadatos y opcionalmente projection.npy con la base PCA
+EMBEDDINGS_VERSION = 5
+
+# Dimensión reducida (PCA) con la que el reconocedor preselecciona candidatos. Solo
+# se aplica si hay más personas registradas que componentes
+PCA_COMPONENTS = 128
+
+def _embedding_file(person_id):
+    """Ruta del archivo .npy con el embedding de una persona."""
+    return os.path.join(FACES_DIR, f"{person_id}.npy")
+
+def _load_manifest():
+    """Carga el manifest de la base (con "faces" vacío si no hay base)."""
+    if not os.path.exists(MANIFEST_FILE):
+        return {"version": EMBEDDINGS_VERSION, "faces": {}}
+    with open(MANIFEST_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_manifest(manifest):
+    """Escribe el manifest de forma atómica (archivo temporal + reemplazo)."""
+    manifest["version"] = EMBEDDINGS_VERSION
+    tmp_file = MANIFEST_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, MANIFEST_FILE)
+
+def _update_projection(manifest):
+    """
+    Con muchas personas, guarda una base PCA con la que el reconocedor
+    preselecciona candidatos en dimensión reducida (la comparación final
+    usa el embedding completo). Se calcula sin centrar los datos, así el
+    producto punto entre proyecciones sigue el orden de la similitud coseno.
+    """
+    faces = manifest["faces"]
+    if len(faces) <= PCA_COMPONENTS:
+        if os.path.exists(PROJECTION_FILE):
+            os.remove(PROJECTION_FILE)
+        manifest.pop("projection", None)
+        return
+
+    # Ajustar la base lee los embeddings de todas las personas (O(N)). Como
+    # una base algo desactualizada solo afecta a la preselección, se vuelve a
+    # ajustar únicamente si cambió el modelo o si el número de personas se
+    # duplicó desde el último ajuste: en promedio cada registro sigue siendo O(1)
+    fitted = manifest.get("projection", {})
+    if (os.path.exists(PROJECTION_FILE) and fitted.get("model") == MODEL_NAME
+            and len(faces) < 2 * fitted.get("faces", 0)):
+        return
+
+    # Recuperar los vectores normalizados (embedding / scale) de toda la base
+    embeddings = np.stack([
+        np.load(_embedding_file(person_id)).astype(np.float32) / data["scale"]
+        for person_id, data in faces.items()
+    ])
+    _, singular_values, vt = np.linalg.svd(embeddings, full_matrices=False)
+    np.save(PROJECTION_FILE, vt[:PCA_COMPONENTS].astype(np.float32))
+    energy = np.sum(singular_values[:PCA_COMPONENTS] ** 2) / np.sum(singular_values ** 2)
+    manifest["projection"] = {"faces": len(faces), "model": MODEL_NAME}
+    print(f"\n📉 PCA: {embeddings.shape[1]} → {PCA_COMPONENTS} dimensiones ({energy*100:.1f}% de la energía)")
+
 def extract_embeddings():
     """
-    Extrae embeddings de todas las fotos en la carpeta de entrenamiento.
+    Extrae embeddings de las fotos nuevas o modificadas en la carpeta de
+    entrenamiento y sincroniza la base con ella.
     """
     print(f"🔍 Buscando imágenes en: {PHOTOS_DIR}")
 
@@ -30,12 +104,17 @@ def extract_embeddings():
         return
 
     # Buscar todas las imágenes
+    # os.scandir filtra por tipo y extensión sin hacer stat de cada archivo.
+    # La fecha de modificación sí cuesta un stat por imagen (en Windows viene
+    # con el listado del directorio): hace falta para detectar las fotos
+    # modificadas y guardarla de las nuevas, y es mucho más barato que volver
+    # a extraer sus embeddings. Se ordena para que el resultado sea determinista
     image_extensions = {'.jpg', '.jpeg', '.png', '.bmp'}
-    image_files = []
-
-    for file in os.listdir(PHOTOS_DIR):
-        if Path(file).suffix.lower() in image_extensions:
-            image_files.append(os.path.join(PHOTOS_DIR, file))
+    with os.scandir(PHOTOS_DIR) as entries:
+        image_files = sorted(
+            (entry.path, entry.stat().st_mtime) for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in image_extensions
+        )
 
     if not image_files:
         print(f"⚠️  No se encontraron imágenes en {PHOTOS_DIR}")
@@ -44,52 +123,109 @@ def extract_embeddings():
 
     print(f"📸 Encontradas {len(image_files)} imágenes")
 
-    # Diccionario para almacenar embeddings
-    # Formato: {"person_id": {"embedding": array, "photo_path": str}}
-    embeddings_db = {}
+    # Usar el nombre del archivo (sin extensión) como ID de persona
+    photos = {Path(img_path).stem: (img_path, mtime) for img_path, mtime in image_files}
 
-    # Procesar cada imagen
-    for idx, img_path in enumerate(image_files, 1):
-        try:
-            print(f"\n[{idx}/{len(image_files)}] Procesando: {os.path.basename(img_path)}")
+    # Metadatos de la base actual
+    # Formato: {"person_id": {"scale": float, "photo_path": str, "photo_mtime": float, "model": str}}
+    manifest = _load_manifest()
+    embeddings_db = manifest["faces"]
+    os.makedirs(FACES_DIR, exist_ok=True)
 
-            # Extraer embedding usando DeepFace
-            # DeepFace.represent retorna una lista de diccionarios con 'embedding' y 'facial_area'
-            result = DeepFace.represent(
-                img_path=img_path,
-                model_name=MODEL_NAME,
-                enforce_detection=True,  # Falla si no detecta un rostro
-                detector_backend="opencv",  # Opciones: opencv, ssd, dlib, mtcnn, retinaface
-                align=True
-            )
+    # Quitar a las personas cuya foto ya no está en la carpeta
+    removed = [person_id for person_id in embeddings_db if person_id not in photos]
+    for person_id in removed:
+        del embeddings_db[person_id]
+        if os.path.exists(_embedding_file(person_id)):
+            os.remove(_embedding_file(person_id))
+        print(f"🗑️  {person_id}: eliminado (ya no hay foto)")
 
-            # Tomar el primer rostro detectado
-            embedding = result[0]["embedding"]
+    # Solo se procesan las fotos nuevas, modificadas o de otro modelo
+    pending = [
+        (person_id, img_path, mtime)
+        for person_id, (img_path, mtime) in photos.items()
+        if embeddings_db.get(person_id, {}).get("photo_path") != img_path
+        or embeddings_db[person_id].get("photo_mtime") != mtime
+        or embeddings_db[person_id].get("model") != MODEL_NAME
+    ]
+    print(f"♻️  {len(photos) - len(pending)} sin cambios, {len(pending)} por procesar")
 
-            # Usar el nombre del archivo (sin extensión) como ID de persona
-            person_id = Path(img_path).stem
+    # Mismo detector Haar y mismo recorte (sin alinear) que recognize_webcam.py:
+    # los embeddings registrados y los de la cámara salen de entradas comparables
+    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
 
-            embeddings_db[person_id] = {
-                "embedding": np.array(embedding),
-                "photo_path": img_path,
-                "model": MODEL_NAME
-            }
+    # Detectar el rostro de cada imagen (la detección sigue siendo por imagen)
+    faces = []
+    face_items = []
+    for idx, (person_id, img_path, mtime) in enumerate(pending, 1):
+        try:
+            print(f"\n[{idx}/{len(pending)}] Procesando: {os.path.basename(img_path)}")
+
+            img = cv2.imread(img_path)  # BGR, como los frames de la cámara
+            if img is None:
+                raise ValueError("No se pudo leer la imagen")
+
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            boxes = face_cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5)
+            if len(boxes) == 0:
+                raise ValueError("No se detectó ningún rostro")
 
-            print(f"   ✅ Embedding extraído (dimensión: {len(embedding)})")
+            # Tomar el rostro más grande
+            x, y, w, h = max(boxes, key=lambda box: box[2] * box[3])
+            faces.append(img[y:y + h, x:x + w])
+            face_items.append((person_id, img_path, mtime))
+
+            print("   ✅ Rostro detectado")
 
         except Exception as e:
             print(f"   ❌ Error procesando {os.path.basename(img_path)}: {str(e)}")
             continue
 
-    # Guardar embeddings
-    if embeddings_db:
-        os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    if faces:
+        # Extraer todos los embeddings en una sola pasada del modelo (batch)
+        print(f"\n🧠 Extrayendo {len(faces)} embeddings con {MODEL_NAME}...")
+        results = DeepFace.represent(
+            img_path=faces,
+            model_name=MODEL_NAME,
+            detector_backend="skip"  # Los rostros ya están recortados
+        )
 
-        with open(EMBEDDINGS_FILE, 'wb') as f:
-            pickle.dump(embeddings_db, f)
+        # Con una sola imagen DeepFace no retorna una lista por imagen
+        if len(faces) == 1:
+            results = [results]
+
+        # Convertir todos los embeddings a una matriz float32 de una vez (la mitad
+        # de memoria que float64) y normalizarlos (norma L2 = 1), así la
+        # similitud coseno al reconocer es un simple producto punto
+        embeddings = np.asarray([result[0]["embedding"] for result in results], dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+
+        # Cuantizar a int8 (4 veces menos memoria que float32); la escala de
+        # cada persona permite recuperar el vector original con embedding / scale
+        scales = 127.0 / np.max(np.abs(embeddings), axis=1)
+        embeddings_int8 = np.round(embeddings * scales[:, None]).astype(np.int8)
+
+        # Cada persona en su propio archivo: no hay que reescribir la base completa
+        for (person_id, img_path, mtime), embedding_int8, scale in zip(face_items, embeddings_int8, scales):
+            np.save(_embedding_file(person_id), embedding_int8)
+            embeddings_db[person_id] = {
+                "scale": float(scale),
+                "photo_path": img_path,
+                "photo_mtime": mtime,
+                "model": MODEL_NAME
+            }
+
+            print(f"   ✅ {person_id}: embedding extraído (dimensión: {len(embedding_int8)})")
+
+    # Guardar metadatos (y la base PCA) solo si la base cambió
+    if faces or removed:
+        _update_projection(manifest)
+        _save_manifest(manifest)
 
         print(f"\n✅ Embeddings guardados exitosamente!")
-        print(f"   Archivo: {EMBEDDINGS_FILE}")
+        print(f"   Directorio: {EMBEDDINGS_DIR}")
+
+    if embeddings_db:
         print(f"   Total de personas registradas: {len(embeddings_db)}")
         print(f"   IDs registrados: {', '.join(embeddings_db.keys())}")
     else:
@@ -99,13 +235,11 @@ def list_registered_faces():
     """
     Lista los rostros registrados en la base de datos.
     """
-    if not os.path.exists(EMBEDDINGS_FILE):
+    embeddings_db = _load_manifest()["faces"]
+    if not embeddings_db:
         print("⚠️  No hay rostros registrados aún")
         return
 
-    with open(EMBEDDINGS_FILE, 'rb') as f:
-        embeddings_db = pickle.load(f)
-
     print(f"\n📋 Rostros registrados: {len(embeddings_db)}")
     for person_id, data in embeddings_db.items():
         print(f"   - {person_id} (modelo: {data.get('model', 'unknown')})")
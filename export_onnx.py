@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Script para exportar el modelo de embeddings a ONNX y cuantizarlo a int8.
+El modelo cuantizado lo usa recognize_webcam.py con onnxruntime si está disponible.
+
+Requiere (solo para exportar): pip install tf2onnx onnx onnxruntime
+"""
+
+import os
+import tensorflow as tf
+import tf2onnx
+from onnxruntime.quantization import quantize_dynamic, QuantType
+from deepface.modules.modeling import build_model
+
+# Configuración
+MODEL_NAME = "Facenet512"  # Debe ser el mismo usado en enroll_faces.py
+MODELS_DIR = "models"
+ONNX_FILE = os.path.join(MODELS_DIR, f"{MODEL_NAME.lower()}.onnx")
+ONNX_INT8_FILE = os.path.join(MODELS_DIR, f"{MODEL_NAME.lower()}_int8.onnx")
+
+def export_model():
+    """
+    Exporta el modelo Keras de DeepFace a ONNX (FP32) y genera una versión
+    cuantizada dinámicamente a int8 para inferencia en CPU.
+    """
+    print(f"🧠 Cargando modelo {MODEL_NAME}...")
+    client = build_model(task="facial_recognition", model_name=MODEL_NAME)
+    height, width = client.input_shape
+
+    os.makedirs(MODELS_DIR, exist_ok=True)
+
+    # Exportar a ONNX con batch dinámico; la entrada es una imagen BGR en [0, 1]
+    print(f"📦 Exportando a ONNX: {ONNX_FILE}")
+    input_signature = [tf.TensorSpec((None, height, width, 3), tf.float32, name="input")]
+    tf2onnx.convert.from_keras(client.model, input_signature=input_signature, output_path=ONNX_FILE)
+
+    # Cuantización dinámica: pesos en int8, activaciones cuantizadas en tiempo de ejecución
+    print(f"🔢 Cuantizando a int8: {ONNX_INT8_FILE}")
+    quantize_dynamic(ONNX_FILE, ONNX_INT8_FILE, weight_type=QuantType.QInt8)
+
+    print(f"\n✅ Modelo exportado exitosamente!")
+    print(f"   FP32: {ONNX_FILE}")
+    print(f"   int8: {ONNX_INT8_FILE}")
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("   EXPORTAR MODELO A ONNX")
+    print("=" * 60)
+
+    export_model()
+
+    print("\n" + "=" * 60)
+    print("✨ Proceso completado")
+    print("=" * 60)
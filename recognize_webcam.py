@@ -5,43 +5,239 @@ Compara rostros detectados con los embeddings almacenados.
 """
 
 import os
+import sys
+import json
 import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
 import cv2
 import numpy as np
 from deepface import DeepFace
-from scipy.spatial.distance import cosine
+from deepface.modules.modeling import build_model
+
+try:
+    import simsimd  # Opcional: kernels SIMD para la distancia coseno
+except ImportError:
+    simsimd = None
+
+try:
+    from numba import njit  # Opcional: compila el kernel de comparación
+except ImportError:
+    njit = None
+
+try:
+    import onnxruntime as ort  # Opcional: inferencia con el modelo int8 generado por export_onnx.py
+except ImportError:
+    ort = None
+
+try:
+    import hnswlib  # Opcional: índice aproximado (HNSW) para muchas personas registradas
+except ImportError:
+    hnswlib = None
 
 # Configuración
-EMBEDDINGS_FILE = "embeddings/face_embeddings.pkl"
+EMBEDDINGS_DIR = "embeddings/db"  # manifest.json + faces/{id}.npy por persona (generado por enroll_faces.py)
+LEGACY_EMBEDDINGS_FILE = "embeddings/face_embeddings.pkl"  # Formato anterior, de un solo archivo
 MODEL_NAME = "Facenet512"
+MODELS_DIR = "models"  # Modelos ONNX exportados con export_onnx.py
+DETECTION_SCALE = 0.5  # La detección se ejecuta sobre el frame reducido a esta escala
+TRACK_IOU_THRESHOLD = 0.3  # IoU mínimo para considerar que un rostro detectado es el mismo del frame anterior
+REEMBED_IOU_THRESHOLD = 0.5  # Si el IoU con la posición del último reconocimiento baja de aquí, se re-identifica
+TRACK_MAX_MISSES = 5  # Frames seguidos que un rostro seguido puede no detectarse antes de descartarlo
 THRESHOLD = 0.4  # Umbral de similitud (menor = más estricto, rango 0-1)
+MOTION_THRESHOLD = 2.0  # Diferencia media de píxeles por debajo de la cual la escena se considera estática
+ANN_MIN_FACES = 500  # A partir de cuántos rostros se usa el índice HNSW en lugar de la búsqueda exacta
+RERANK_CANDIDATES = 10  # Con base PCA, candidatos que se vuelven a comparar con el embedding completo
+
+# Formato de captura solicitado a cámaras USB/integradas
+CAMERA_WIDTH = 640
+CAMERA_HEIGHT = 480
+CAMERA_FPS = 30
+
+# Backend de captura para cámaras locales: evita que OpenCV pruebe varios por índice
+if sys.platform.startswith("linux"):
+    CAMERA_BACKEND = cv2.CAP_V4L2
+elif sys.platform == "win32":
+    CAMERA_BACKEND = cv2.CAP_DSHOW
+else:
+    CAMERA_BACKEND = cv2.CAP_ANY
 
 # Colores para el texto (BGR)
 COLOR_RECOGNIZED = (0, 255, 0)  # Verde
 COLOR_UNKNOWN = (0, 0, 255)  # Rojo
 COLOR_PROCESSING = (255, 255, 0)  # Cyan
 
+def _quantize_int8(x):
+    """
+    Cuantiza vectores a int8 con una escala por vector, de modo que el valor
+    de mayor magnitud quede en ±127.
+    Retorna: (vectores int8, escalas); x ≈ vectores / escalas
+    """
+    scale = 127.0 / np.max(np.abs(x), axis=-1, keepdims=True)
+    return np.round(x * scale).astype(np.int8), scale
+
+def _best_match(probe, matrix, row_scales):
+    """
+    Compara el embedding de entrada (float32, ya normalizado) contra la
+    matriz de embeddings cuantizados (int8) y retorna (índice, similitud)
+    del más parecido en una sola pasada sobre los datos.
+    """
+    n, d = matrix.shape
+
+    best_idx = 0
+    best_sim = -np.inf
+    for i in range(n):
+        dot = 0.0
+        for j in range(d):
+            dot += probe[j] * matrix[i, j]
+        sim = dot * row_scales[i]
+        if sim > best_sim:
+            best_sim = sim
+            best_idx = i
+
+    return best_idx, best_sim
+
+if njit is not None:
+    _best_match = njit(cache=True, fastmath=True)(_best_match)
+
+def _iou(a, b):
+    """Intersección sobre unión de dos áreas faciales {"x", "y", "w", "h"}."""
+    ix = max(0, min(a["x"] + a["w"], b["x"] + b["w"]) - max(a["x"], b["x"]))
+    iy = max(0, min(a["y"] + a["h"], b["y"] + b["h"]) - max(a["y"], b["y"]))
+    intersection = ix * iy
+    union = a["w"] * a["h"] + b["w"] * b["h"] - intersection
+    return intersection / union if union > 0 else 0.0
+
+def _gpu_available():
+    """Indica si TensorFlow tiene una GPU CUDA disponible."""
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return False
+    return bool(tf.config.list_physical_devices("GPU"))
+
+USE_GPU = _gpu_available()
+
+def _put_latest(q, item):
+    """Coloca item en una cola de tamaño 1, descartando el elemento anterior si lo hay."""
+    try:
+        q.get_nowait()
+    except Empty:
+        pass
+    q.put_nowait(item)
+
 class FaceRecognizer:
-    def __init__(self, embeddings_file, model_name, threshold):
-        self.embeddings_file = embeddings_file
+    def __init__(self, embeddings_dir, model_name, threshold):
+        self.embeddings_dir = embeddings_dir
+        self._db_file = None  # Archivo cuya fecha indica la última modificación de la base
         self.model_name = model_name
         self.threshold = threshold
         self.embeddings_db = {}
+        self._ids = []
+        self._emb_matrix = None
+        self._row_scales = None
+        self._projection = None
+        self._pca_matrix = None
+        self._pca_scales = None
+        self._index = None
         self.load_embeddings()
 
-    def detect_available_cameras(self, max_cameras=5):
-        """Detecta las cámaras disponibles."""
-        available_cameras = []
+        # Últimos rostros detectados, compartidos entre el hilo de inferencia y el de visualización
+        self.detections = []  # Lista de: {"facial_area": dict, "label": str, "color": tuple}
+        self._detection_lock = threading.Lock()
+
+        # Rostros seguidos entre frames (solo los usa el hilo de inferencia)
+        self._tracks = []
+
+        # Miniatura en grises del último frame reconocido, para detectar movimiento
+        self._prev_gray = None
+
+        # Usar el modelo ONNX exportado con onnxruntime si existe: en GPU el
+        # modelo FP32 con CUDA (la cuantización dinámica int8 no tiene kernels
+        # CUDA), en CPU el modelo int8. Si no, precargar el modelo de DeepFace
+        # una sola vez (DeepFace lo guarda en caché y lo reutiliza; TensorFlow
+        # usa la GPU automáticamente si está disponible)
+        self._ort = None
+        if ort is not None:
+            onnx_file = os.path.join(MODELS_DIR, f"{self.model_name.lower()}.onnx")
+            onnx_int8_file = os.path.join(MODELS_DIR, f"{self.model_name.lower()}_int8.onnx")
+
+            # get_available_providers() solo indica que onnxruntime se compiló
+            # con CUDA; si no hay GPU la sesión cae a CPU, y eso solo se ve en
+            # los providers de la sesión ya creada
+            if "CUDAExecutionProvider" in ort.get_available_providers() and os.path.exists(onnx_file):
+                session = ort.InferenceSession(onnx_file, providers=["CUDAExecutionProvider", "CPUExecutionProvider"])
+                if "CUDAExecutionProvider" in session.get_providers():
+                    print(f"🧠 Cargando modelo ONNX: {onnx_file} (GPU)")
+                    self._ort = session
+
+            if self._ort is None and os.path.exists(onnx_int8_file):
+                print(f"🧠 Cargando modelo ONNX: {onnx_int8_file} (CPU)")
+                self._ort = ort.InferenceSession(onnx_int8_file, providers=["CPUExecutionProvider"])
+
+        if self._ort is not None:
+            ort_input = self._ort.get_inputs()[0]
+            self._ort_input_name = ort_input.name
+            self._ort_input_size = (ort_input.shape[2], ort_input.shape[1])  # (ancho, alto)
+        else:
+            print(f"🧠 Cargando modelo {self.model_name} ({'GPU' if USE_GPU else 'CPU'})...")
+            # Solo carga el modelo en la caché de DeepFace, que DeepFace.represent
+            # reutiliza; no hace falta guardar la referencia
+            build_model(task="facial_recognition", model_name=self.model_name)
+
+        # Detector Haar de OpenCV: lo bastante rápido para ejecutarse en cada frame
+        self._face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+
+    def warmup(self):
+        """Ejecuta una inferencia de prueba para que el primer frame real no sea lento."""
+        self.embed_faces([np.zeros((160, 160, 3), dtype=np.uint8)])
 
+    def embed_faces(self, faces):
+        """
+        Extrae los embeddings de una lista de rostros ya recortados (imágenes
+        BGR) en una sola pasada del modelo.
+        Retorna: array (N, D)
+        """
+        if self._ort is not None:
+            # Mismo preprocesamiento que DeepFace: BGR escalado a [0, 1]. Los
+            # recuadros del detector Haar son cuadrados, basta con redimensionar
+            batch = np.stack([cv2.resize(face, self._ort_input_size) for face in faces])
+            batch = batch.astype(np.float32) / 255.0
+            return self._ort.run(None, {self._ort_input_name: batch})[0]
+
+        # Los rostros ya están detectados: extraer los embeddings sin volver a
+        # ejecutar un detector
+        results = DeepFace.represent(
+            img_path=faces,
+            model_name=self.model_name,
+            detector_backend="skip"
+        )
+
+        # Con un solo rostro DeepFace no retorna una lista por imagen
+        if len(faces) == 1:
+            results = [results]
+
+        return np.asarray([result[0]["embedding"] for result in results], dtype=np.float32)
+
+    def detect_available_cameras(self, max_cameras=5):
+        """Detecta las cámaras disponibles, probando todos los índices en paralelo."""
         print("\n🔍 Buscando cámaras disponibles...")
-        for i in range(max_cameras):
-            cap = cv2.VideoCapture(i)
-            if cap.isOpened():
-                ret, _ = cap.read()
-                if ret:
-                    available_cameras.append(i)
-                    print(f"   ✅ Cámara {i} detectada")
-                cap.release()
+
+        def probe(i):
+            cap = cv2.VideoCapture(i, CAMERA_BACKEND)
+            ok = cap.isOpened() and cap.read()[0]
+            cap.release()
+            return ok
+
+        # Abrir una cámara puede tardar cientos de ms: en paralelo el tiempo
+        # total es el de la prueba más lenta, no la suma de todas
+        with ThreadPoolExecutor(max_workers=max_cameras) as executor:
+            results = list(executor.map(probe, range(max_cameras)))
+
+        available_cameras = [i for i, ok in enumerate(results) if ok]
+        for i in available_cameras:
+            print(f"   ✅ Cámara {i} detectada")
 
         return available_cameras
 
@@ -84,44 +280,396 @@ class FaceRecognizer:
             print("⚠️  Opción inválida, usando cámara 0 por defecto")
             return 0
 
+    def open_camera(self, camera_source):
+        """
+        Abre la fuente de video pidiendo un formato que minimice los datos a
+        transferir y convertir.
+        """
+        if isinstance(camera_source, str):
+            # Webcam WiFi: decodificar con FFmpeg; en RTSP usar UDP para menor latencia
+            if camera_source.startswith("rtsp://"):
+                os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;udp")
+            cap = cv2.VideoCapture(camera_source, cv2.CAP_FFMPEG)
+        else:
+            # Cámara USB/integrada: pedir MJPEG (la cámara envía frames
+            # comprimidos en lugar de YUY2) con resolución y FPS explícitos
+            cap = cv2.VideoCapture(camera_source, CAMERA_BACKEND)
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
+            cap.set(cv2.CAP_PROP_FPS, CAMERA_FPS)
+
+        # Pedir al driver un buffer de un solo frame para no acumular frames viejos
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
     def load_embeddings(self):
         """Carga los embeddings de rostros registrados."""
-        if not os.path.exists(self.embeddings_file):
-            print(f"❌ Error: No se encontró {self.embeddings_file}")
+        manifest_file = os.path.join(self.embeddings_dir, "manifest.json")
+        if os.path.exists(manifest_file):
+            version, matrix = self._read_embeddings_dir(manifest_file)
+        elif os.path.exists(LEGACY_EMBEDDINGS_FILE):
+            version, matrix = self._read_legacy_embeddings(LEGACY_EMBEDDINGS_FILE)
+        else:
+            print(f"❌ Error: No se encontró {manifest_file}")
             print("   Ejecuta primero 'enroll_faces.py' para registrar rostros")
             exit(1)
 
-        with open(self.embeddings_file, 'rb') as f:
-            self.embeddings_db = pickle.load(f)
+        # Desde la versión 2 los embeddings se guardan ya normalizados, y desde
+        # la versión 3 también cuantizados a int8
+        if version < 3:
+            matrix = matrix.astype(np.float32)
+            if version < 2:
+                matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix, _ = _quantize_int8(matrix)
+
+        self._emb_matrix = np.ascontiguousarray(matrix, dtype=np.int8)
+
+        # Factor por fila que convierte el producto punto int8 en similitud:
+        # el inverso de la norma de cada fila cuantizada (la escala int8 no
+        # afecta a la similitud coseno, solo hay que normalizar)
+        norms = np.linalg.norm(self._emb_matrix.astype(np.float32), axis=1)
+        self._row_scales = (1.0 / norms).astype(np.float32)
+
+        if self._projection is not None:
+            # Proyectar los embeddings normalizados a la base PCA guardada al
+            # registrar y volver a cuantizarlos: la búsqueda recorre k < D
+            # valores por rostro. La proyección descarta parte de la energía de
+            # cada vector y subestima la similitud, así que solo sirve para
+            # preseleccionar candidatos; la matriz completa se conserva para
+            # la comparación final
+            projected = (self._emb_matrix.astype(np.float32) * self._row_scales[:, None]) @ self._projection.T
+            matrix, scales = _quantize_int8(projected)
+            self._pca_matrix = np.ascontiguousarray(matrix)
+            self._pca_scales = (1.0 / scales[:, 0]).astype(np.float32)
+
+        # Con muchos rostros, la búsqueda exacta O(N) se reemplaza por un índice HNSW
+        if hnswlib is not None and len(self._ids) >= ANN_MIN_FACES:
+            self._index = self._load_ann_index()
 
         print(f"✅ Cargados {len(self.embeddings_db)} rostros registrados")
         print(f"   IDs: {', '.join(self.embeddings_db.keys())}")
 
+    def _read_embeddings_dir(self, manifest_file):
+        """
+        Lee la base en formato de directorio (v5): manifest.json con los
+        metadatos y un faces/{person_id}.npy int8 por persona.
+        Retorna: (versión, matriz (N, D) int8)
+        """
+        with open(manifest_file, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        self.embeddings_db = manifest["faces"]
+        self._ids = list(self.embeddings_db.keys())
+        self._db_file = manifest_file
+
+        if not self._ids:
+            print(f"❌ Error: No hay rostros registrados en {self.embeddings_dir}")
+            print("   Agrega fotos y ejecuta 'enroll_faces.py'")
+            exit(1)
+
+        # Precalcular una matriz (N, D) int8 con los embeddings cuantizados:
+        # ocupa 4 veces menos que float32, y cada comparación se reduce a un
+        # único recorrido sobre la matriz
+        matrix = np.stack([
+            np.load(os.path.join(self.embeddings_dir, "faces", f"{person_id}.npy"))
+            for person_id in self._ids
+        ])
+
+        projection_file = os.path.join(self.embeddings_dir, "projection.npy")
+        if os.path.exists(projection_file):
+            self._projection = np.load(projection_file)
+
+        return manifest["version"], matrix
+
+    def _read_legacy_embeddings(self, embeddings_file):
+        """
+        Lee la base en el formato anterior de un solo .pkl (v1 a v4).
+        Retorna: (versión, matriz (N, D))
+        """
+        with open(embeddings_file, 'rb') as f:
+            data = pickle.load(f)
+
+        # Formato versionado: {"version": int, "faces": {...}}. Los archivos
+        # antiguos (sin versión) son directamente el diccionario de rostros.
+        if "version" in data:
+            version = data["version"]
+            self.embeddings_db = data["faces"]
+            self._projection = data.get("projection")
+        else:
+            version = 1
+            self.embeddings_db = data
+
+        self._ids = list(self.embeddings_db.keys())
+        self._db_file = embeddings_file
+
+        if version >= 4:
+            # En la versión 4 la matriz se guarda aparte en un .npy, con las
+            # filas en el mismo orden que los metadatos; se mapea en memoria
+            # sin copiarla
+            matrix_file = os.path.splitext(embeddings_file)[0] + ".npy"
+            matrix = np.load(matrix_file, mmap_mode="r")
+        else:
+            matrix = np.stack([self.embeddings_db[k]["embedding"] for k in self._ids])
+
+        return version, matrix
+
+    def _load_ann_index(self):
+        """
+        Carga el índice HNSW guardado junto a los embeddings, o lo construye
+        (y lo guarda) si no existe o es más antiguo que la base de datos.
+        """
+        index_file = os.path.join(os.path.dirname(self._db_file), "hnsw.bin")
+
+        # Con base PCA el índice se construye sobre las proyecciones
+        if self._projection is not None:
+            matrix, row_scales = self._pca_matrix, self._pca_scales
+        else:
+            matrix, row_scales = self._emb_matrix, self._row_scales
+        num_faces, dim = matrix.shape
+
+        # Espacio de producto interno: las filas ya están normalizadas (o
+        # proyectadas con PCA), igual que en la búsqueda exacta
+        index = hnswlib.Index(space="ip", dim=dim)
+
+        if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(self._db_file):
+            index.load_index(index_file, max_elements=num_faces)
+        else:
+            print(f"🔧 Construyendo índice HNSW para {num_faces} rostros...")
+            index.init_index(max_elements=num_faces, ef_construction=200, M=16)
+            index.add_items(matrix.astype(np.float32) * row_scales[:, None], np.arange(num_faces))
+            index.save_index(index_file)
+
+        index.set_ef(50)
+        return index
+
     def find_match(self, embedding):
         """
         Encuentra el rostro más similar en la base de datos.
         Retorna: (person_id, similarity_score) o (None, None) si no hay match
         """
-        best_match = None
-        best_distance = float('inf')
-
-        for person_id, data in self.embeddings_db.items():
-            stored_embedding = data["embedding"]
-
-            # Calcular distancia coseno (0 = idéntico, 2 = opuesto)
-            distance = cosine(embedding, stored_embedding)
+        # Normalizar el embedding de entrada: la similitud contra todos los
+        # rostros registrados es entonces un producto punto por fila
+        probe = np.asarray(embedding, dtype=np.float32)
+        probe = probe / np.linalg.norm(probe)
+
+        if self._projection is not None:
+            # Preseleccionar en la base PCA y volver a comparar los candidatos
+            # con el embedding completo, así THRESHOLD y la similitud mostrada
+            # no dependen de cuánta energía conserva la proyección
+            candidates = self._pca_candidates(self._projection @ probe)
+            similarities = (self._emb_matrix[candidates] @ probe) * self._row_scales[candidates]
+
+            best = int(similarities.argmax())
+            best_idx = int(candidates[best])
+            best_distance = 1.0 - float(similarities[best])
+        elif self._index is not None:
+            # Búsqueda aproximada O(log N) en el índice HNSW (distancia = 1 - producto punto)
+            labels, distances = self._index.knn_query(probe, k=1)
+            best_idx = int(labels[0][0])
+            best_distance = float(distances[0][0])
+        elif simsimd is not None:
+            # SimSIMD calcula los N productos punto int8 con instrucciones SIMD; es
+            # el kernel más rápido a partir de ~1000 rostros (2-4× sobre Numba)
+            # (requiere que el embedding de entrada también sea int8)
+            probe_int8, probe_scale = _quantize_int8(probe)
+            dots = np.asarray(simsimd.cdist(probe_int8[None, :], self._emb_matrix, metric="dot"))[0]
+            similarities = dots * self._row_scales / probe_scale[0]
+
+            best_idx = int(similarities.argmax())
+            best_distance = 1.0 - float(similarities[best_idx])
+        elif njit is not None:
+            # Kernel compilado con Numba: compara contra la matriz int8 y elige el mejor sin temporales
+            best_idx, best_similarity = _best_match(probe, self._emb_matrix, self._row_scales)
+            best_distance = 1.0 - float(best_similarity)
+        else:
+            similarities = (self._emb_matrix @ probe) * self._row_scales
 
-            if distance < best_distance:
-                best_distance = distance
-                best_match = person_id
+            best_idx = int(similarities.argmax())
+            best_distance = 1.0 - float(similarities[best_idx])  # Distancia coseno (0 = idéntico, 2 = opuesto)
 
         # Si la distancia es menor al umbral, es un match
         if best_distance < self.threshold:
             similarity = 1 - best_distance  # Convertir a similitud (0-1)
-            return best_match, similarity
+            return self._ids[best_idx], similarity
         else:
             return None, None
 
+    def _pca_candidates(self, probe):
+        """
+        Retorna los índices de los RERANK_CANDIDATES rostros más parecidos al
+        embedding de entrada ya proyectado a la base PCA.
+        """
+        k = min(RERANK_CANDIDATES, len(self._ids))
+
+        if self._index is not None:
+            labels, _ = self._index.knn_query(probe, k=k)
+            return labels[0].astype(np.intp)
+
+        if simsimd is not None:
+            probe_int8, _ = _quantize_int8(probe)
+            dots = np.asarray(simsimd.cdist(probe_int8[None, :], self._pca_matrix, metric="dot"))[0]
+            similarities = dots * self._pca_scales
+        else:
+            similarities = (self._pca_matrix @ probe) * self._pca_scales
+
+        return np.argpartition(-similarities, k - 1)[:k]
+
+    def identify_faces(self, frame, facial_areas):
+        """
+        Extrae en un solo batch los embeddings de los rostros en facial_areas
+        y los compara con la base de datos.
+        Retorna: lista de {"facial_area": dict, "label": str, "color": tuple, "embedded_area": dict}
+        (None en cada posición si no se pudieron extraer los embeddings)
+        """
+        try:
+            # Extraer los embeddings de los recortes en resolución completa
+            embeddings = self.embed_faces([
+                frame[area["y"]:area["y"] + area["h"], area["x"]:area["x"] + area["w"]]
+                for area in facial_areas
+            ])
+        except Exception:
+            return [None] * len(facial_areas)
+
+        identified = []
+        for facial_area, embedding in zip(facial_areas, embeddings):
+            # Buscar coincidencia
+            person_id, similarity = self.find_match(embedding)
+
+            if person_id:
+                # Rostro reconocido
+                color = COLOR_RECOGNIZED
+                label = f"{person_id} ({similarity*100:.1f}%)"
+            else:
+                # Rostro desconocido
+                color = COLOR_UNKNOWN
+                label = "DESCONOCIDO"
+
+            identified.append({
+                "facial_area": facial_area,
+                "label": label,
+                "color": color,
+                "embedded_area": facial_area  # Posición en la que se extrajo el embedding
+            })
+
+        return identified
+
+    def recognize_frame(self, frame):
+        """
+        Detecta los rostros del frame y los asocia por IoU con los rostros
+        seguidos en frames anteriores. Solo se extrae el embedding de los
+        rostros nuevos o que se desplazaron desde su último reconocimiento.
+        Retorna: lista de {"facial_area": dict, "label": str, "color": tuple, ...}
+        """
+        # Detectar rostros sobre el frame reducido en grises: el costo del
+        # detector crece con el número de píxeles
+        small = cv2.resize(frame, (0, 0), fx=DETECTION_SCALE, fy=DETECTION_SCALE)
+        gray_small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        boxes = self._face_cascade.detectMultiScale(gray_small, scaleFactor=1.2, minNeighbors=5)
+
+        tracks = []
+        pending = []  # (posición en tracks, facial_area) de los rostros a identificar
+        unmatched = list(self._tracks)
+
+        for (bx, by, bw, bh) in boxes:
+            # Escalar a coordenadas del frame original
+            facial_area = {
+                "x": int(bx / DETECTION_SCALE),
+                "y": int(by / DETECTION_SCALE),
+                "w": int(bw / DETECTION_SCALE),
+                "h": int(bh / DETECTION_SCALE)
+            }
+
+            # Asociar con el rostro seguido de mayor IoU
+            best = max(unmatched, key=lambda t: _iou(t["facial_area"], facial_area), default=None)
+
+            if best is not None and _iou(best["facial_area"], facial_area) >= TRACK_IOU_THRESHOLD:
+                unmatched.remove(best)
+                tracks.append(dict(best, facial_area=facial_area, misses=0))
+
+                # Re-identificar solo si se desplazó desde su último reconocimiento
+                if _iou(best["embedded_area"], facial_area) < REEMBED_IOU_THRESHOLD:
+                    pending.append((len(tracks) - 1, facial_area))
+            else:
+                # Rostro nuevo
+                tracks.append(None)
+                pending.append((len(tracks) - 1, facial_area))
+
+        # Identificar todos los rostros nuevos o desplazados en un solo batch;
+        # si falla, los desplazados conservan su identificación anterior
+        if pending:
+            identified = self.identify_faces(frame, [area for _, area in pending])
+            for (position, _), track in zip(pending, identified):
+                if track is not None:
+                    tracks[position] = track
+
+        tracks = [track for track in tracks if track is not None]
+
+        # El detector Haar falla a menudo de forma intermitente: los rostros
+        # seguidos que no aparecen en este frame se conservan en su última
+        # posición y solo se descartan tras TRACK_MAX_MISSES frames seguidos,
+        # así al volver a detectarse no se calcula de nuevo su embedding
+        for track in unmatched:
+            misses = track.get("misses", 0) + 1
+            if misses <= TRACK_MAX_MISSES:
+                tracks.append(dict(track, misses=misses))
+
+        self._tracks = tracks
+        return tracks
+
+    def _has_motion(self, frame):
+        """
+        Compara una miniatura en grises del frame con la del último frame
+        reconocido. Retorna False si la escena no ha cambiado.
+        """
+        gray = cv2.cvtColor(cv2.resize(frame, (160, 90)), cv2.COLOR_BGR2GRAY)
+
+        if self._prev_gray is not None and np.mean(cv2.absdiff(gray, self._prev_gray)) < MOTION_THRESHOLD:
+            return False
+
+        self._prev_gray = gray
+        return True
+
+    def _capture_loop(self, cap, display_queue, inference_queue, stop_event):
+        """Hilo de captura: lee frames y publica siempre el más reciente."""
+        while not stop_event.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                print("❌ Error al capturar frame")
+                stop_event.set()
+                break
+
+            _put_latest(display_queue, frame)
+            _put_latest(inference_queue, frame)
+
+    def _inference_loop(self, inference_queue, stop_event):
+        """Hilo de inferencia: procesa el frame más reciente y actualiza las detecciones."""
+        while not stop_event.is_set():
+            try:
+                frame = inference_queue.get(timeout=0.5)
+            except Empty:
+                continue
+
+            try:
+                # Escena estática: se mantienen las últimas detecciones sin procesar
+                # el frame. Si algún rostro seguido dejó de detectarse, se sigue
+                # procesando hasta que reaparezca o se descarte, para que un
+                # rostro que salió de la escena no quede dibujado indefinidamente
+                has_missing_tracks = any(track.get("misses", 0) > 0 for track in self._tracks)
+                if not self._has_motion(frame) and not has_missing_tracks:
+                    continue
+
+                detections = self.recognize_frame(frame)
+            except Exception:
+                # Si hay error, limpiar las detecciones (y los rostros seguidos)
+                # en lugar de dejar que el hilo termine con los recuadros congelados
+                self._tracks = []
+                detections = []
+
+            # Guardar detecciones para mantenerlas visibles (o limpiarlas si no hay rostros)
+            with self._detection_lock:
+                self.detections = detections
+
     def run_webcam_recognition(self):
         """Ejecuta reconocimiento facial en tiempo real con webcam."""
         print(f"\n⚙️  Modelo: {self.model_name}")
@@ -134,7 +682,7 @@ class FaceRecognizer:
         print("\n📌 Presiona 'q' para salir\n")
 
         # Inicializar cámara con la fuente seleccionada
-        cap = cv2.VideoCapture(camera_source)
+        cap = self.open_camera(camera_source)
 
         if not cap.isOpened():
             print(f"❌ Error: No se pudo abrir la cámara")
@@ -145,77 +693,52 @@ class FaceRecognizer:
             print("   - Prueba con un índice diferente (0, 1, 2...)")
             return
 
-        # Variables para control de procesamiento
-        frame_count = 0
-        process_every_n_frames = 10  # Procesar cada 10 frames para mejor rendimiento
-
-        # Estado persistente del último resultado detectado
-        last_detection = None  # Guardará: {"facial_area": dict, "label": str, "color": tuple}
-
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("❌ Error al capturar frame")
-                break
-
-            frame_count += 1
-            display_frame = frame.copy()
-
-            # Procesar solo cada N frames
-            if frame_count % process_every_n_frames == 0:
-                try:
-                    # Detectar y extraer embedding del rostro
-                    result = DeepFace.represent(
-                        img_path=frame,
-                        model_name=self.model_name,
-                        enforce_detection=False,  # No fallar si no detecta rostro
-                        detector_backend="opencv",
-                        align=True
-                    )
-
-                    # Si se detectó al menos un rostro
-                    if result and len(result) > 0:
-                        # Procesar el primer rostro detectado
-                        embedding = np.array(result[0]["embedding"])
-                        facial_area = result[0]["facial_area"]
-
-                        # Buscar coincidencia
-                        person_id, similarity = self.find_match(embedding)
-
-                        # Preparar información de detección
-                        x = facial_area["x"]
-                        y = facial_area["y"]
-                        w = facial_area["w"]
-                        h = facial_area["h"]
-
-                        if person_id:
-                            # Rostro reconocido
-                            color = COLOR_RECOGNIZED
-                            label = f"{person_id} ({similarity*100:.1f}%)"
-                        else:
-                            # Rostro desconocido
-                            color = COLOR_UNKNOWN
-                            label = "DESCONOCIDO"
-
-                        # Guardar detección para mantenerla visible
-                        last_detection = {
-                            "facial_area": facial_area,
-                            "label": label,
-                            "color": color
-                        }
-                    else:
-                        # No se detectó rostro, limpiar detección previa
-                        last_detection = None
-
-                except Exception as e:
-                    # Si hay error (ej: no se detecta rostro), limpiar detección
-                    last_detection = None
-
-            # Dibujar la última detección válida en TODOS los frames
-            if last_detection:
-                facial_area = last_detection["facial_area"]
-                label = last_detection["label"]
-                color = last_detection["color"]
+        # Calentar el modelo antes de entrar al bucle
+        self.warmup()
+
+        # Colas de tamaño 1: siempre contienen solo el frame más reciente
+        display_queue = Queue(maxsize=1)
+        inference_queue = Queue(maxsize=1)
+        stop_event = threading.Event()
+
+        # Captura e inferencia en hilos separados: la visualización mantiene los
+        # FPS de la cámara aunque la inferencia tarde cientos de ms
+        capture_thread = threading.Thread(
+            target=self._capture_loop,
+            args=(cap, display_queue, inference_queue, stop_event),
+            daemon=True
+        )
+        inference_thread = threading.Thread(
+            target=self._inference_loop,
+            args=(inference_queue, stop_event),
+            daemon=True
+        )
+        capture_thread.start()
+        inference_thread.start()
+
+        display_frame = None
+
+        while not stop_event.is_set():
+            try:
+                frame = display_queue.get(timeout=0.5)
+            except Empty:
+                continue
+
+            # El frame capturado también lo lee el hilo de inferencia, así que no
+            # se puede dibujar sobre él; se copia a un buffer reutilizado en vez
+            # de reservar una imagen nueva en cada frame
+            if display_frame is None or display_frame.shape != frame.shape:
+                display_frame = np.empty_like(frame)
+            np.copyto(display_frame, frame)
+
+            with self._detection_lock:
+                detections = self.detections
+
+            # Dibujar las últimas detecciones válidas en TODOS los frames
+            for detection in detections:
+                facial_area = detection["facial_area"]
+                label = detection["label"]
+                color = detection["color"]
 
                 x = facial_area["x"]
                 y = facial_area["y"]
@@ -259,8 +782,17 @@ class FaceRecognizer:
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
 
-        # Limpiar
-        cap.release()
+        # Detener los hilos y limpiar
+        stop_event.set()
+        inference_thread.join()
+
+        # Con una webcam WiFi que dejó de responder, cap.read() puede quedar
+        # bloqueado hasta el timeout de FFmpeg: no esperar indefinidamente. Si
+        # el hilo sigue dentro de read() no se libera la captura (no es seguro
+        # hacerlo en paralelo); al ser daemon termina junto con el programa
+        capture_thread.join(timeout=1.0)
+        if not capture_thread.is_alive():
+            cap.release()
         cv2.destroyAllWindows()
         print("\n👋 Webcam cerrada")
 
@@ -270,7 +802,7 @@ if __name__ == "__main__":
     print("=" * 60)
 
     recognizer = FaceRecognizer(
-        embeddings_file=EMBEDDINGS_FILE,
+        embeddings_dir=EMBEDDINGS_DIR,
         model_name=MODEL_NAME,
         threshold=THRESHOLD
     )